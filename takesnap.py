@@ -1,8 +1,118 @@
 import maya.cmds as cmds # type: ignore
+import maya.mel as mel # type: ignore
 import os
-import traceback # エラー詳細表示用
+import re
+import pathlib
+import sys
 import tempfile # 一時ファイル作成用
+import shutil # 一時ディレクトリ削除用
 import time # ファイル名用
+import collections
+import logging
+import logging.handlers
+import concurrent.futures # ファイル確認の並行処理用
+
+# UI から一度に読み取った設定値 (ボタン処理の先頭で1回だけ読み取る)
+_UIState = collections.namedtuple('_UIState', ['folder', 'base', 'width', 'height', 'filter_key', 'mode_key', 'panels'])
+
+# playblast の連番パディング桁数と、戻り値のパス中でフレーム番号が入る部分
+_FRAME_PADDING = 4
+_FRAME_TOKEN = "#" * _FRAME_PADDING
+
+
+# 撮影処理のログ。Script Editor への出力は1行ごとに再描画を伴うので、メモリに溜めてまとめて書き出す
+# (ERROR 以上はその場で書き出す)。ツールを再実行してもハンドラーが重複しないようにする
+_logger = logging.getLogger("snaptool")
+if not _logger.handlers:
+    _logger.addHandler(logging.handlers.MemoryHandler(capacity=64, target=logging.StreamHandler(sys.stdout)))
+    _logger.setLevel(logging.INFO)
+    _logger.propagate = False
+
+
+def _flush_log():
+    """メモリに溜めたログを Script Editor にまとめて書き出す。"""
+    for handler in _logger.handlers:
+        handler.flush()
+
+
+def _resolve_output_file(raw_result, expected_path, padded_frame):
+    """
+    playblast の戻り値から実際に書き出されたファイルを求め、(パス, サイズ) を返す。
+    ファイルが見つからない場合のサイズは None。
+    Maya の状態には触れないので、ワーカースレッドから呼び出してよい。
+    """
+    # 戻り値がリストなら最初の要素、無効な場合は期待パス (str または Path) で確認
+    path = raw_result[0] if isinstance(raw_result, (list, tuple)) and raw_result else raw_result
+    if not isinstance(path, str) or not path:
+        path = os.fspath(expected_path)
+    # 開始・終了フレームが同じなので、連番部分をパディング済みのフレーム番号に置き換えれば実際のパスになる
+    path = path.replace(_FRAME_TOKEN, padded_frame)
+    # exists + getsize ではなく stat 1回で存在確認とサイズ取得を行う
+    try:
+        return path, os.stat(path).st_size
+    except OSError:
+        return path, None
+
+
+# stateString 中の真偽値フラグ (例: "-polymeshes 1") を取り出す正規表現 (モジュール読み込み時に1回だけコンパイル)
+_STATE_FLAG_PATTERN = re.compile(r'-(\w+) ([01])(?![\w.])')
+# プラグインの表示フィルター (例: '-pluginObjects "gpuCacheDisplayFilter" 1')。allObjects=False で一緒に非表示になる
+_STATE_PLUGIN_PATTERN = re.compile(r'-pluginObjects "([^"]+)" ([01])(?![\w.])')
+# 差分復元の対象にする表示フラグ (撮影時の allObjects / 各オブジェクトの表示で変わるもののみ)。
+# stateString には値がたまたま 0/1 の数値フラグ (-lineWidth 1 など) も含まれるため、ここにないフラグは扱わない
+_STATE_SHOW_FLAGS = frozenset([
+    'polymeshes', 'nurbsSurfaces', 'nurbsCurves', 'subdivSurfaces', 'planes', 'lights', 'cameras',
+    'joints', 'ikHandles', 'deformers', 'dynamics', 'particleInstancers', 'fluids', 'hairSystems',
+    'follicles', 'nCloths', 'nParticles', 'nRigids', 'dynamicConstraints', 'locators', 'dimensions',
+    'pivots', 'handles', 'textures', 'strokes', 'motionTrails', 'clipGhosts', 'greasePencils',
+    'controlVertices', 'hulls', 'manipulators', 'imagePlane',
+])
+
+
+# パネル名 -> ツールが最後に確認/設定した Isolate Select の状態 (復元時の再問い合わせを省く)
+_ISO_STATE_CACHE = {} # type: dict[str, bool]
+
+
+# 表示設定の復元で出すメッセージ (% 形式。ロガーに渡し、書き出すときに初めて組み立てる)
+_MSG_RESTORE_START = "[%s] 表示設定を復元中..."
+_MSG_RESTORE_SKIPPED = "[%s] 表示設定は変更されていないため、復元を省略します。"
+_MSG_RESTORE_NOT_MODEL_PANEL = "[%s] 警告: パネルが存在しないかモデルパネルではないため、表示設定を復元できません。"
+_MSG_ISO_RESTORED = "[%s] Isolate Select の状態を元 (%s) に戻しました。"
+_MSG_STATE_RESTORED = "[%s] modelEditor 設定を復元しました。"
+_MSG_FLAGS_UNCHANGED = "[%s] modelEditor 設定に変更はありません。"
+_MSG_STATE_NOT_SAVED = "[%s] 警告: 元の modelEditor 設定が保存されていませんでした。"
+_MSG_RESTORE_ERROR = "[%s] !!! 表示設定の復元中にエラーが発生しました: %s"
+_MSG_FLAGS_RESTORE_FAILED = "[%s] 差分での復元に失敗したため、全体を復元します: %s"
+_MSG_FLAGS_RESTORED = "[%s] modelEditor 設定 (%s項目) を復元しました。"
+
+
+def _parse_state_flags(state_string):
+    """
+    modelEditor の stateString から、_STATE_SHOW_FLAGS の表示フラグを {フラグ名: bool} として取り出す。
+    プラグインの表示フィルターは ('pluginObjects', フィルター名) をキーにして同じ dict に入れる。
+    """
+    flags = {flag: value == '1' for flag, value in _STATE_FLAG_PATTERN.findall(state_string)
+             if flag in _STATE_SHOW_FLAGS}
+    for filter_name, value in _STATE_PLUGIN_PATTERN.findall(state_string):
+        flags[('pluginObjects', filter_name)] = value == '1'
+    return flags
+
+
+def _build_filter_edit_flags(filter_enable):
+    """
+    フィルターごとに、allObjects=False (すべて非表示) と有効化するフラグを1つの dict にまとめる。
+    modelEditor はフラグを引数の順ではなく決まった順 (allObjects が先) で適用するため、
+    個別のフラグを False にして同時に渡すと有効化が打ち消される。非表示は allObjects=False だけで行う。
+    allObjects=True のフィルター ('all') は有効化のフラグのみ渡す。
+    """
+    edit_flags = {}
+    for filter_key, enable in filter_enable.items():
+        if enable.get('allObjects'):
+            edit_flags[filter_key] = dict(enable)
+        else:
+            edit_flags[filter_key] = {'allObjects': False, **enable}
+    return edit_flags
+
 
 class ViewportSnapshotTool:
     """
@@ -14,6 +124,22 @@ class ViewportSnapshotTool:
     # プレビュー画像のサイズ
     PREVIEW_WIDTH = 320
     PREVIEW_HEIGHT = 180
+    # プレビューは使い捨てなので JPEG エンコードを省ける非圧縮形式で書き出す
+    PREVIEW_IMAGE_FORMAT = 'bmp'
+
+    # 撮影後のファイル確認を行うワーカースレッド数の上限
+    FILE_CHECK_WORKERS = 4
+
+    # オブジェクトフィルターごとに表示するフラグ (未知のフィルターは 'all' 扱い)
+    _FILTER_ENABLE = {
+        'all': {'allObjects': True},
+        'mesh': {'polymeshes': True, 'subdivSurfaces': True},
+        'joint': {'joints': True},
+        'mesh_joint': {'polymeshes': True, 'subdivSurfaces': True, 'joints': True},
+        'nurbs': {'nurbsCurves': True, 'nurbsSurfaces': True},
+    }
+    # フィルターごとに、非表示 (allObjects=False) と上の有効化をまとめた1回の edit で渡す設定
+    _FILTER_EDIT_FLAGS = _build_filter_edit_flags(_FILTER_ENABLE)
 
     def __init__(self):
         """
@@ -30,10 +156,22 @@ class ViewportSnapshotTool:
         self.height_field = None
         self.filter_menu = None
         self.display_mode_menu = None
+        self.viewport_scroll_layout = None
         self.viewport_checkbox_group = None
         self.preview_image_control = None
         self.temp_preview_file = None # 一時プレビューファイルのパス
+        # プレビュー用の一時ディレクトリはセッション中使い回し、ウィンドウを閉じたときにまとめて削除する
+        self._preview_dir = tempfile.mkdtemp(prefix="snapshot_preview_")
+        self._preview_count = 0 # プレビューのファイル名に付ける連番
         self.available_model_panels = [] # 利用可能なモデルパネル名のリスト
+        self._isolate_cache = {} # パネル名 -> Isolate Select が利用可能か (update_viewport_list でクリア)
+        self._preview_scheduled = False # プレビュー更新が evalDeferred で予約済みか
+        self._preview_pending = False # 予約後にさらに更新要求があったか
+        self._debug = False # True にすると例外発生時にトレースバックを表示
+        self._verbose = False # True にすると撮影処理の詳細ログを表示
+        self._snapshot_queue = [] # 撮影待ちの (パネル名, 期待パス)
+        self._snapshot_batch = None # 実行中の撮影の設定と途中結果
+        self._dirty_panels = set() # 撮影用に表示設定を変更し、まだ復元していないパネル
 
         # --- デフォルト設定値 ---
         self.default_width = 1920
@@ -101,8 +239,8 @@ class ViewportSnapshotTool:
         }
         for display_name in self.filter_options.keys():
             cmds.menuItem(label=display_name)
-        default_display_name = next((dn for dn, key in self.filter_options.items() if key == self.default_filter_key), list(self.filter_options.keys())[0])
-        cmds.optionMenu(self.filter_menu, edit=True, value=default_display_name)
+        self._filter_default_display = next((dn for dn, key in self.filter_options.items() if key == self.default_filter_key), list(self.filter_options.keys())[0])
+        cmds.optionMenu(self.filter_menu, edit=True, value=self._filter_default_display)
         cmds.setParent('..')
 
         # 4. 表示モード設定 (新規追加)
@@ -117,8 +255,8 @@ class ViewportSnapshotTool:
         }
         for display_name in self.display_mode_options.keys():
             cmds.menuItem(label=display_name)
-        default_display_name_mode = next((dn for dn, key in self.display_mode_options.items() if key == self.default_display_mode_key), list(self.display_mode_options.keys())[0])
-        cmds.optionMenu(self.display_mode_menu, edit=True, value=default_display_name_mode)
+        self._display_mode_default_display = next((dn for dn, key in self.display_mode_options.items() if key == self.default_display_mode_key), list(self.display_mode_options.keys())[0])
+        cmds.optionMenu(self.display_mode_menu, edit=True, value=self._display_mode_default_display)
         cmds.setParent('..')
 
         cmds.setParent('..') # basic_tab を抜ける
@@ -127,11 +265,9 @@ class ViewportSnapshotTool:
         viewport_tab = cmds.columnLayout("ビューポート選択", adjustableColumn=True, rowSpacing=5, columnAttach=('both', 5))
         cmds.text(label="スナップショットを撮るビューポートを選択してください:", align='left')
         # スクロール可能なレイアウト内にチェックボックスを配置
-        scroll_layout = cmds.scrollLayout(horizontalScrollBarThickness=16, verticalScrollBarThickness=16, height=150)
-        # チェックボックスグループ (縦並び)
-        self.viewport_checkbox_group = cmds.columnLayout(adjustableColumn=True)
+        self.viewport_scroll_layout = cmds.scrollLayout(horizontalScrollBarThickness=16, verticalScrollBarThickness=16, height=150)
+        # チェックボックスグループ (縦並び) は update_viewport_list 内で作成される
         self.update_viewport_list() # ビューポートリストを初期化
-        cmds.setParent('..') # viewport_checkbox_group
         cmds.setParent('..') # scroll_layout
         cmds.setParent('..') # viewport_tab
 
@@ -165,6 +301,19 @@ class ViewportSnapshotTool:
         cmds.scriptJob(uiDeleted=(self.window, self.cleanup_temp_file), protected=True)
 
 
+    def show(self):
+        """
+        既存のウィンドウを前面に表示する (UIは作り直さない)。
+        表示中のパネルが変わっている可能性があるので、ビューポートのリスト (とパネルごとのキャッシュ) は作り直す。
+        ウィンドウが既に閉じられている場合は何もせず False を返す。
+        """
+        if not cmds.window(self.WINDOW_NAME, exists=True):
+            return False
+        self.update_viewport_list()
+        cmds.showWindow(self.window)
+        return True
+
+
     # --- GUI操作に対応するメソッド ---
 
     def browse_folderpath(self, *args):
@@ -181,34 +330,41 @@ class ViewportSnapshotTool:
 
     def update_viewport_list(self):
         """利用可能なモデルパネルをリストアップし、チェックボックスUIを更新"""
-        # 現在のチェックボックスを削除
-        children = cmds.columnLayout(self.viewport_checkbox_group, query=True, childArray=True)
-        if children:
-            for child in children:
-                cmds.deleteUI(child)
+        # パネル構成が変わる可能性があるのでパネルごとのキャッシュを破棄
+        self._isolate_cache.clear()
 
-        # 表示されているモデルパネルを取得
-        self.available_model_panels = cmds.getPanel(type='modelPanel')
-        visible_panels = cmds.getPanel(visiblePanels=True)
-        # 表示されていて、かつモデルパネルであるものを抽出
-        self.available_model_panels = [p for p in self.available_model_panels if p in visible_panels]
+        # チェックボックスを1つずつ削除せず、グループのレイアウトごと作り直す (deleteUI は1回で済む)
+        # 新しいグループは非表示 (manage=False) で作り、中身をすべて追加してから表示してレイアウト計算を1回にする
+        previous_parent = cmds.setParent(query=True)
+        if self.viewport_checkbox_group and cmds.columnLayout(self.viewport_checkbox_group, exists=True):
+            cmds.deleteUI(self.viewport_checkbox_group)
+        self.viewport_checkbox_group = cmds.columnLayout(adjustableColumn=True, manage=False, parent=self.viewport_scroll_layout)
+        cmds.setParent(previous_parent)
 
-        if not self.available_model_panels:
-            cmds.text(label="利用可能なビューポートが見つかりません。", parent=self.viewport_checkbox_group)
-            return
+        try:
+            # 表示されているモデルパネルを取得
+            visible_panels = set(cmds.getPanel(visiblePanels=True) or [])
+            # 表示されていて、かつモデルパネルであるものを抽出
+            self.available_model_panels = [p for p in cmds.getPanel(type='modelPanel') or [] if p in visible_panels]
 
-        # 各パネルに対してチェックボックスを作成
-        for panel_name in self.available_model_panels:
-            # パネルのカメラ名を取得してラベルに表示 (例: modelPanel4 (persp))
-            try:
-                camera = cmds.modelEditor(panel_name, query=True, camera=True)
-                label = f"{panel_name} ({camera})"
-            except:
-                label = panel_name # カメラ取得失敗時はパネル名のみ
-            # チェックボックスを作成し、親をグループに設定
-            cmds.checkBox(label=label, value=True, parent=self.viewport_checkbox_group,
-                          # データをチェックボックス自体に保持（後で取得するため）
-                          annotation=panel_name) # annotation にパネル名を保存
+            if not self.available_model_panels:
+                cmds.text(label="利用可能なビューポートが見つかりません。", parent=self.viewport_checkbox_group)
+                return
+
+            # 各パネルに対してチェックボックスを作成
+            for panel_name in self.available_model_panels:
+                # パネルのカメラ名を取得してラベルに表示 (例: modelPanel4 (persp))
+                try:
+                    camera = cmds.modelEditor(panel_name, query=True, camera=True)
+                    label = f"{panel_name} ({camera})"
+                except:
+                    label = panel_name # カメラ取得失敗時はパネル名のみ
+                # チェックボックスを作成し、親をグループに設定
+                cmds.checkBox(label=label, value=True, parent=self.viewport_checkbox_group,
+                              # データをチェックボックス自体に保持（後で取得するため）
+                              annotation=panel_name) # annotation にパネル名を保存
+        finally:
+            cmds.columnLayout(self.viewport_checkbox_group, edit=True, manage=True)
 
 
     def get_selected_viewports(self):
@@ -224,41 +380,67 @@ class ViewportSnapshotTool:
         return selected_panels
 
     def update_preview(self, *args):
+        """
+        プレビュー更新を予約する。アイドル時にまとめて実行するため、
+        連続で呼ばれても playblast は最新の設定で1回だけ行われる。
+        """
+        if self._preview_scheduled:
+            self._preview_pending = True
+            return
+        self._preview_scheduled = True
+        cmds.evalDeferred(self._do_preview, lowestPriority=True)
+
+    def _do_preview(self):
+        """予約されたプレビュー更新を実行する。実行中に新たな要求が来ていればもう1回実行する。"""
+        try:
+            while cmds.window(self.WINDOW_NAME, exists=True):
+                self._preview_pending = False
+                self._render_preview()
+                if not self._preview_pending:
+                    break
+        finally:
+            self._preview_scheduled = False
+            _flush_log()
+
+    def _render_preview(self):
         """プレビュー画像を生成して表示"""
-        print("\n--- プレビュー更新開始 ---")
-        selected_panels = self.get_selected_viewports()
+        self._log("\n--- プレビュー更新開始 ---")
+        state = self._read_ui_state(include_output=False)
+        selected_panels = state.panels
         if not selected_panels:
             cmds.warning("プレビュー対象のビューポートが選択されていません。")
             cmds.image(self.preview_image_control, edit=True, image="")
-            print("プレビュー対象なし。更新処理を中断します。")
+            self._log("プレビュー対象なし。更新処理を中断します。")
             return
 
         target_panel = selected_panels[0]
-        print(f"プレビュー対象パネル: {target_panel}")
+        self._log("プレビュー対象パネル: %s", target_panel)
 
         width = self.PREVIEW_WIDTH
         height = self.PREVIEW_HEIGHT
-        filter_key = self.get_filter_key()
-        mode_key = self.get_display_mode_key()
-        print(f"プレビュー設定 - Filter: '{filter_key}', Mode: '{mode_key}', Resolution: {width}x{height}")
+        filter_key = state.filter_key
+        mode_key = state.mode_key
+        self._log("プレビュー設定 - Filter: '%s', Mode: '%s', Resolution: %sx%s", filter_key, mode_key, width, height)
 
+        # 選択は1回だけ取得し、generate_snapshot にも渡す
+        current_selection = None
         if mode_key == 'selected_only':
-            current_selection = cmds.ls(selection=True)
+            current_selection = cmds.ls(selection=True, long=True)
             if not current_selection:
                 cmds.warning("'選択オブジェクトのみ' モードですが、何も選択されていません。プレビューは更新されません。")
                 cmds.image(self.preview_image_control, edit=True, image="")
-                print("選択オブジェクトなしのため、プレビュー処理を中断します。")
+                self._log("選択オブジェクトなしのため、プレビュー処理を中断します。")
                 return
 
         # --- 一時ファイルの準備 ---
-        self.cleanup_temp_file()
+        previous_preview_file = self.temp_preview_file
         try:
-            # 最初に仮の一時ファイルパスを生成 (playblastのfilename引数に渡すため)
-            temp_fd, initial_temp_path = tempfile.mkstemp(suffix=".jpg", prefix="maya_preview_")
-            os.close(temp_fd)
+            # 画像コントロールは同じパスを渡すとキャッシュ済みの古い画像を表示することがあるため、
+            # 一時ディレクトリは使い回しつつ、ファイル名は毎回連番で変える (前回のファイルは最後に削除)
             # self.temp_preview_file は generate_snapshot 内で実際のパスに更新される *可能性がある*
-            self.temp_preview_file = initial_temp_path # 初期パスとして保持
-            print(f"一時プレビューファイル 初期期待パス: {self.temp_preview_file}")
+            self._preview_count += 1
+            self.temp_preview_file = os.path.join(self._preview_dir, f"preview_{self._preview_count}.{self.PREVIEW_IMAGE_FORMAT}") # 初期パスとして保持
+            self._log("一時プレビューファイル 初期期待パス: %s", self.temp_preview_file)
 
             # --- スナップショット生成の実行 ---
             snapshot_success = False
@@ -271,31 +453,33 @@ class ViewportSnapshotTool:
                     height=height,
                     display_filter=filter_key,
                     display_mode=mode_key,
-                    is_preview=True
+                    is_preview=True,
+                    current_selection=current_selection
                 )
                 snapshot_success = True # エラーなく完了
             except Exception as gen_e:
                  cmds.warning(f"スナップショット生成中にエラーが発生しました: {gen_e}")
-                 print("generate_snapshot で例外発生:")
-                 print(traceback.format_exc())
+                 self._print_traceback("generate_snapshot で例外発生:")
                  snapshot_success = False
 
             # --- 結果の確認と画像表示 (self.temp_preview_file が実際のパスになっていることを期待) ---
-            if snapshot_success and self.temp_preview_file and os.path.exists(self.temp_preview_file):
-                file_size = os.path.getsize(self.temp_preview_file)
-                print(f"一時ファイル確認 (更新後): 存在します。パス: {self.temp_preview_file}, サイズ: {file_size} bytes")
+            try: preview_stat = os.stat(self.temp_preview_file) if snapshot_success and self.temp_preview_file else None
+            except OSError: preview_stat = None
+            if preview_stat is not None:
+                file_size = preview_stat.st_size
+                self._log("一時ファイル確認 (更新後): 存在します。パス: %s, サイズ: %s bytes", self.temp_preview_file, file_size)
                 if file_size > 0:
-                    print(f"画像コントロール '{self.preview_image_control}' を更新します...")
+                    self._log("画像コントロール '%s' を更新します...", self.preview_image_control)
                     try:
                         cmds.image(self.preview_image_control, edit=True, image=self.temp_preview_file)
-                        print("画像コントロールの更新コマンドを実行しました。")
+                        self._log("画像コントロールの更新コマンドを実行しました。")
                     except Exception as img_e:
                         cmds.warning(f"画像コントロールの更新中にエラー: {img_e}")
-                        print(f"cmds.image 更新エラー: {traceback.format_exc()}")
+                        self._print_traceback("cmds.image 更新エラー:")
                         cmds.image(self.preview_image_control, edit=True, image="")
                 else:
                     cmds.warning("プレビュー画像は生成されましたが、中身が空のようです (ファイルサイズ 0)。表示設定を確認してください。")
-                    print("ファイルサイズが0のため、プレビューは表示されません。")
+                    self._log("ファイルサイズが0のため、プレビューは表示されません。")
                     cmds.image(self.preview_image_control, edit=True, image="")
             else:
                 if snapshot_success:
@@ -307,34 +491,36 @@ class ViewportSnapshotTool:
 
         except Exception as e:
             cmds.warning(f"プレビュー処理全体で予期せぬエラーが発生しました: {e}")
-            print("プレビュー処理の包括的エラー:")
-            print(traceback.format_exc())
+            self._print_traceback("プレビュー処理の包括的エラー:")
             cmds.image(self.preview_image_control, edit=True, image="")
         finally:
-            print("--- プレビュー更新処理終了 ---")
+            if previous_preview_file and previous_preview_file != self.temp_preview_file:
+                try: os.remove(previous_preview_file)
+                except OSError: pass
+            self._log("--- プレビュー更新処理終了 ---")
 
     def cleanup_temp_file(self, *args):
-        """一時プレビューファイルを削除"""
-        # 以前のコードのままでOK
-        if hasattr(self, 'temp_preview_file') and self.temp_preview_file:
-            if os.path.exists(self.temp_preview_file):
-                try:
-                    os.remove(self.temp_preview_file)
-                    print(f"一時ファイルを削除しました: {self.temp_preview_file}")
-                except OSError as e:
-                    print(f"一時ファイルの削除に失敗しました: {self.temp_preview_file}. エラー: {e}")
-            self.temp_preview_file = None
+        """プレビュー用の一時ディレクトリを中身ごと削除 (ウィンドウ削除時に呼ばれる)"""
+        if getattr(self, '_preview_dir', None) and os.path.isdir(self._preview_dir):
+            shutil.rmtree(self._preview_dir, ignore_errors=True)
+            print(f"一時ディレクトリを削除しました: {self._preview_dir}")
+        self.temp_preview_file = None
+
     def execute_snapshot(self, *args):
-        """「スナップショット撮影実行」ボタンの処理"""
-        print("\n--- スナップショット処理開始 ---")
+        """「スナップショット撮影実行」ボタンの処理 (撮影自体はパネルごとに evalDeferred で順に行う)"""
+        if self._snapshot_queue:
+            cmds.warning("スナップショット撮影を実行中です。完了してから再度実行してください。")
+            return
+        self._log("\n--- スナップショット処理開始 ---")
         # UIから設定値を取得
-        folder_path = self.get_folder_path()
-        filename_base = self.get_filename_base()
-        width = self.get_width()
-        height = self.get_height()
-        filter_key = self.get_filter_key()
-        mode_key = self.get_display_mode_key()
-        selected_panels = self.get_selected_viewports()
+        state = self._read_ui_state()
+        folder_path = state.folder
+        filename_base = state.base
+        width = state.width
+        height = state.height
+        filter_key = state.filter_key
+        mode_key = state.mode_key
+        selected_panels = state.panels
 
         # --- バリデーション ---
         if not folder_path or not filename_base:
@@ -347,14 +533,15 @@ class ViewportSnapshotTool:
             cmds.warning("スナップショットを撮るビューポートを少なくとも1つ選択してください。")
             return
 
-        # --- ディレクトリ存在確認・作成 ---
-        if not os.path.exists(folder_path):
+        # --- ディレクトリ存在確認・作成 (以降は解決済みの Path を使い回す) ---
+        folder = pathlib.Path(folder_path)
+        if not folder.exists():
             try:
                 response = cmds.confirmDialog(
                     title='フォルダ作成確認', message=f'指定されたフォルダが存在しません:\n{folder_path}\n\n作成しますか？',
                     button=['はい', 'いいえ'], defaultButton='はい', cancelButton='いいえ', dismissString='いいえ')
                 if response == 'はい':
-                    os.makedirs(folder_path)
+                    folder.mkdir(parents=True)
                     print(f"フォルダを作成しました: {folder_path}")
                 else:
                     cmds.warning("フォルダが存在しないため、処理を中止しました。")
@@ -362,53 +549,95 @@ class ViewportSnapshotTool:
             except OSError as e:
                 cmds.warning(f"フォルダの作成に失敗しました: {folder_path}. エラー: {e}")
                 return
+        folder = folder.resolve()
 
-        # --- 各選択ビューポートに対して処理を実行 ---
-        success_files = []
-        error_panels = []
+        # --- 各選択ビューポートの出力パスを決定 ---
+        targets = []
         for panel_name in selected_panels:
-            print(f"\nビューポート '{panel_name}' の処理を開始...")
+            # ファイル名を生成 (ベース名 + カメラ名 + 拡張子)
             try:
-                # ファイル名を生成 (ベース名 + パネル名 + 拡張子)
-                # パネル名からカメラ名を取得してファイル名に含める方がわかりやすいかも
-                try:
-                    cam_name = cmds.modelEditor(panel_name, query=True, camera=True)
-                    # ファイル名に使えない文字を置換 (例: | を _)
-                    safe_cam_name = cam_name.replace('|', '_').replace(':', '_')
-                    filename_suffix = f"_{safe_cam_name}"
-                except:
-                    filename_suffix = f"_{panel_name}"
-
-                # タイムスタンプを追加して一意性を高める（オプション）
-                # timestamp = time.strftime("%Y%m%d_%H%M%S")
-                # full_filename = f"{filename_base}{filename_suffix}_{timestamp}{self.default_extension}"
-                full_filename = f"{filename_base}{filename_suffix}{self.default_extension}"
-                filepath = os.path.join(folder_path, full_filename)
+                # カメラは撮影ごとに切り替えられている可能性があるので、キャッシュせず毎回取得する
+                cam_name = cmds.modelEditor(panel_name, query=True, camera=True)
+                # ファイル名に使えない文字を置換 (例: | を _)
+                safe_cam_name = cam_name.replace('|', '_').replace(':', '_')
+                filename_suffix = f"_{safe_cam_name}"
+            except:
+                filename_suffix = f"_{panel_name}"
+
+            # タイムスタンプを追加して一意性を高める（オプション）
+            # timestamp = time.strftime("%Y%m%d_%H%M%S")
+            # full_filename = f"{filename_base}{filename_suffix}_{timestamp}{self.default_extension}"
+            full_filename = f"{filename_base}{filename_suffix}{self.default_extension}"
+            targets.append((panel_name, folder.joinpath(full_filename)))
+
+        self._log("  解像度: %s x %s", width, height)
+        self._log("  オブジェクトフィルター: %s", filter_key)
+        self._log("  表示モード: %s", mode_key)
+
+        # --- 撮影 ---
+        # パネルごとに evalDeferred で1枚ずつ撮影し、その間に UI の再描画や保留中の評価を処理させる
+        # (ファイル確認はワーカースレッドで並行して行い、最後にまとめて結果を回収する)
+        progress_bar = mel.eval('$tmp = $gMainProgressBar')
+        cmds.progressBar(progress_bar, edit=True, beginProgress=True, isInterruptable=False,
+                         status="スナップショット撮影中...", maxValue=len(targets))
+        self._snapshot_queue = list(targets)
+        self._snapshot_batch = {
+            'width': width, 'height': height,
+            # フィルター・表示モードは全パネル共通なので、撮影設定はここで1回だけ求める
+            'capture_settings': self._build_capture_settings(filter_key, mode_key),
+            'progress_bar': progress_bar,
+            'executor': concurrent.futures.ThreadPoolExecutor(max_workers=min(self.FILE_CHECK_WORKERS, len(targets))),
+            'pending': [],  # (パネル名, ファイル確認の Future)
+            'error_panels': [],
+        }
+        cmds.evalDeferred(self._process_next_snapshot, lowestPriority=True)
 
-                print(f"  ファイルパス: {filepath}")
-                print(f"  解像度: {width} x {height}")
-                print(f"  オブジェクトフィルター: {filter_key}")
-                print(f"  表示モード: {mode_key}")
+    def _process_next_snapshot(self):
+        """撮影キューから1パネル取り出して撮影し、残りがあれば次のアイドル時に再予約する。"""
+        batch = self._snapshot_batch
+        try:
+            panel_name, filepath = self._snapshot_queue.pop(0)
+            self._log("\nビューポート '%s' の撮影...", panel_name)
+            self._log("  ファイルパス: %s", filepath)
+            try:
+                raw_result, padded_frame = self._capture_panel(panel_name, filepath, batch['width'], batch['height'],
+                                                               batch['capture_settings'])
+                future = batch['executor'].submit(_resolve_output_file, raw_result, filepath, padded_frame)
+                batch['pending'].append((panel_name, future))
+            except Exception as e:
+                cmds.warning(f"ビューポート '{panel_name}' の処理中にエラーが発生しました。")
+                _logger.error("エラー詳細: %s", e)
+                self._print_traceback()
+                batch['error_panels'].append(panel_name)
+            cmds.progressBar(batch['progress_bar'], edit=True, step=1)
+        except Exception:
+            # 予期せぬエラーでも撮影を打ち切って後始末する
+            self._snapshot_queue = []
+            self._print_traceback("撮影キュー処理中の予期せぬエラー:")
+
+        if self._snapshot_queue:
+            cmds.evalDeferred(self._process_next_snapshot, lowestPriority=True)
+        else:
+            self._finish_snapshot_batch()
 
-                # スナップショット生成メソッド呼び出し
-                self.generate_snapshot(
-                    panel=panel_name,
-                    filepath=filepath,
-                    width=width,
-                    height=height,
-                    display_filter=filter_key,
-                    display_mode=mode_key,
-                    is_preview=False # 本番撮影
-                )
-                success_files.append(filepath)
-                print(f"ビューポート '{panel_name}' の処理完了。")
+    def _finish_snapshot_batch(self):
+        """撮影キューの完了後、ファイル確認の結果を回収して最終結果を表示する。"""
+        batch, self._snapshot_batch = self._snapshot_batch, None
+        cmds.progressBar(batch['progress_bar'], edit=True, endProgress=True)
 
-            except Exception as e:
-                error_msg = f"ビューポート '{panel_name}' の処理中にエラーが発生しました。"
-                cmds.warning(error_msg)
-                print(f"エラー詳細: {e}")
-                print(traceback.format_exc())
+        # --- ファイル確認の結果を回収 ---
+        success_files = []
+        error_panels = batch['error_panels']
+        for panel_name, future in batch['pending']:
+            final_filepath, file_size = future.result()
+            if file_size is not None:
+                self._log("[%s] ファイル生成確認: 存在します。パス: %s, サイズ: %s bytes", panel_name, final_filepath, file_size)
+                success_files.append(final_filepath)
+                self._log("ビューポート '%s' の処理完了。", panel_name)
+            else:
+                cmds.warning(f"ビューポート '{panel_name}' のファイルが見つかりません: {final_filepath}")
                 error_panels.append(panel_name)
+        batch['executor'].shutdown()
 
         # --- 最終結果の表示 ---
         if success_files:
@@ -420,7 +649,8 @@ class ViewportSnapshotTool:
         if error_panels:
             cmds.warning(f"{len(error_panels)} 件のビューポートでエラーが発生しました: {', '.join(error_panels)}\n詳細はスクリプトエディタを確認してください。")
 
-        print("\n--- 全スナップショット処理完了 ---")
+        self._log("\n--- 全スナップショット処理完了 ---")
+        _flush_log()
 
 
     def close_window(self, *args):
@@ -454,188 +684,345 @@ class ViewportSnapshotTool:
         selected_display_name = cmds.optionMenu(self.display_mode_menu, query=True, value=True)
         return self.display_mode_options.get(selected_display_name, 'scene_objects')
 
+    def _read_ui_state(self, include_output=True):
+        """
+        UI の設定値をまとめて読み取り _UIState で返す。
+        include_output=False の場合 (プレビュー用)、保存先と解像度は読み取らず None になる。
+        """
+        if include_output:
+            folder, base = self.get_folder_path(), self.get_filename_base()
+            width, height = self.get_width(), self.get_height()
+        else:
+            folder = base = width = height = None
+        return _UIState(folder, base, width, height,
+                        self.get_filter_key(), self.get_display_mode_key(), self.get_selected_viewports())
 
-# --- スナップショット撮影のコア機能 (generate_snapshot) ---
-    def generate_snapshot(self, panel, filepath, width, height, display_filter, display_mode, is_preview=False):
+
+    def _log(self, message, *args):
         """
-        指定された設定でビューポートのスナップショットを撮影する内部メソッド。
-        (playblastの戻り値の #### 置換対応)
+        詳細ログを表示する (self._verbose が True のときのみ)。
+        引数は % 形式で渡し、ログを出さないときは文字列の組み立て自体を行わない。
+        出力はメモリに溜められ、_flush_log でまとめて書き出される。
+        ロガーのレベルで INFO が無効な場合も、ログのレコード自体を作らない。
         """
-        print(f"\n--- generate_snapshot 開始: パネル='{panel}', ファイル='{filepath}' ---")
-        if not cmds.modelPanel(panel, exists=True):
-             print(f"エラー: 指定されたパネル '{panel}' が存在しません。")
-             raise ValueError(f"指定されたパネル '{panel}' が存在しません。")
+        if self._verbose and _logger.isEnabledFor(logging.INFO):
+            _logger.info(message, *args)
 
-        def is_isolate_select_available(target_panel):
-            try: cmds.isolateSelect(target_panel, query=True); return True
-            except: return False
-
-        # --- 1. 元の表示設定を保存 --- (変更なし)
-        original_settings = {}
-        isolation_state = False
-        isolate_available = is_isolate_select_available(panel)
-        flags_to_query = [
-            'allObjects', 'polymeshes', 'nurbsSurfaces', 'nurbsCurves', 'subdivSurfaces',
-            'planes', 'lights', 'cameras', 'joints', 'ikHandles', 'deformers',
-            'dynamicConstraints', 'locators', 'dimensions', 'handles', 'pivots',
-            'textures', 'strokes', 'fluids', 'follicles', 'hairSystems',
-            'nCloths', 'nParticles', 'nRigids',
-            'displayAppearance', 'displayTextures', 'displayLights', 'shadows',
-            'wireframeOnShaded', 'xray', 'jointXray',
-            'grid', 'hud', 'manipulators'
-        ]
-        print(f"[{panel}] 元の設定を保存中...")
-        queried_count = 0
-        for flag in flags_to_query:
-            try: original_settings[flag] = cmds.modelEditor(panel, query=True, **{flag: True}); queried_count += 1
-            except RuntimeError: pass
-        print(f"[{panel}] {queried_count} 項目の設定を保存しました。")
-        if isolate_available:
-            try: isolation_state = cmds.isolateSelect(panel, query=True, state=True); print(f"[{panel}] 元の Isolate Select 状態: {isolation_state}")
-            except Exception as iso_e: print(f"[{panel}] 元の Isolate Select 状態の取得に失敗: {iso_e}"); isolation_state = False
-        else: print(f"[{panel}] Isolate Select はこのパネルでは利用できません。")
+    def _print_traceback(self, header=None):
+        """デバッグ時のみ、処理中の例外のトレースバックを表示する (traceback はこのとき初めて読み込む)"""
+        if not self._debug:
+            return
+        import traceback
+        _flush_log() # 溜めたログより先にトレースバックが出ないようにする
+        if header:
+            print(header)
+        traceback.print_exc(file=sys.stdout)
+
+    def _probe_isolate(self, panel):
+        """パネルで Isolate Select が利用できるかを問い合わせる (結果は _isolate_cache に保持される)"""
+        try: cmds.isolateSelect(panel, query=True); return True
+        except: return False
 
-        # --- try...finally ---
+
+    # --- ビューポート更新の一時停止/再開 ---
+    def _suspend_viewport_refresh(self):
+        """
+        ビューポートの再描画を一時停止し、メインペインを非管理状態にする。
+        modelEditor の設定変更ごとに再描画が走るのを防ぐため。
+        戻り値のメインペイン名は _resume_viewport_refresh に渡す。
+        """
+        cmds.refresh(suspend=True)
+        main_pane = None
+        try:
+            main_pane = mel.eval('$tmp = $gMainPane')
+            if main_pane:
+                cmds.paneLayout(main_pane, edit=True, manage=False)
+        except RuntimeError as e:
+            print(f"メインペインの一時停止に失敗しました (再描画の停止のみ行います): {e}")
+            main_pane = None
+        return main_pane
+
+    def _resume_viewport_refresh(self, main_pane, force=False):
+        """_suspend_viewport_refresh で停止した再描画を再開する。force=True なら1回だけ強制再描画する。"""
         try:
-            # --- 2. 表示設定の変更 --- (変更なし)
-            print(f"[{panel}] 表示設定を変更中: Filter='{display_filter}', Mode='{display_mode}'")
-            show_ornaments = True
-            isolate_activated = False
-            if display_mode == 'scene_objects': show_ornaments = False
-            elif display_mode == 'viewport_all': show_ornaments = True
-            elif display_mode == 'selected_only':
-                show_ornaments = False
-                current_selection = cmds.ls(selection=True, long=True)
-                if current_selection and isolate_available:
-                    try: cmds.isolateSelect(panel, state=True); isolate_activated = True
-                    except Exception as iso_e: print(f"[{panel}] Isolate Select の有効化に失敗: {iso_e}")
-                elif not current_selection: print(f"[{panel}] '選択オブジェクトのみ' モードですが、選択がありません。(generate_snapshot)")
-                elif not isolate_available: print(f"[{panel}] '選択オブジェクトのみ' モードですが、Isolate Select が利用できません。")
-            settings_to_disable = {
-                'allObjects': False, 'polymeshes': False, 'nurbsSurfaces': False, 'nurbsCurves': False,
-                'subdivSurfaces': False, 'planes': False, 'lights': False, 'cameras': False,
-                'joints': False, 'ikHandles': False, 'deformers': False, 'dynamicConstraints': False,
-                'locators': False, 'manipulators': False, 'dimensions': False, 'handles': False,
-                'pivots': False, 'textures': False, 'strokes': False, 'fluids': False, 'follicles': False,
-                'hairSystems': False, 'nCloths': False, 'nParticles': False, 'nRigids': False
-            }
-            cmds.modelEditor(panel, edit=True, **settings_to_disable)
-            settings_to_enable = {}
-            if display_filter == 'all': settings_to_enable['allObjects'] = True
-            elif display_filter == 'mesh': settings_to_enable.update({'polymeshes': True, 'subdivSurfaces': True})
-            elif display_filter == 'joint': settings_to_enable['joints'] = True
-            elif display_filter == 'mesh_joint': settings_to_enable.update({'polymeshes': True, 'subdivSurfaces': True, 'joints': True})
-            elif display_filter == 'nurbs': settings_to_enable.update({'nurbsCurves': True, 'nurbsSurfaces': True})
-            else: settings_to_enable['allObjects'] = True
-            if settings_to_enable: cmds.modelEditor(panel, edit=True, **settings_to_enable)
+            if main_pane:
+                cmds.paneLayout(main_pane, edit=True, manage=True)
+        except RuntimeError as e:
+            print(f"メインペインの再開に失敗しました: {e}")
+        finally:
+            cmds.refresh(suspend=False)
+        if force:
+            cmds.refresh(force=True)
 
-            # --- 3. スナップショット撮影 ---
-            print(f"[{panel}] Playblast 実行準備: 解像度={width}x{height}, 装飾={show_ornaments}")
-            current_time = int(cmds.currentTime(query=True)) # フレーム番号は整数で取得
-            start_frame = current_time # 静止画なので開始フレーム番号を保持
-            print(f"[{panel}] Playblast (初期期待パス): {filepath}")
-            actual_filepath_raw = None # playblastからの生の戻り値
-            try:
-                actual_filepath_raw = cmds.playblast(
-                    activeEditor=False, editorPanelName=panel,
-                    startTime=start_frame, endTime=start_frame, # 開始・終了フレームを指定
-                    format='image',
-                    filename=filepath,
-                    sequenceTime=0, clearCache=True, viewer=False,
-                    showOrnaments=show_ornaments, offScreen=True, forceOverwrite=True,
-                    framePadding=4, # #### に合わせてパディングを4に (重要)
-                    percent=100, quality=100, widthHeight=[width, height]
-                )
-                print(f"[{panel}] Playblast 正常終了。")
-                print(f"[{panel}] Playblast 戻り値 (Raw): {actual_filepath_raw}")
-            except Exception as pb_e:
-                 print(f"[{panel}] !!! Playblast 実行中にエラーが発生しました: {pb_e}")
-                 raise pb_e
-
-            # --- ▼▼▼ ファイルパス処理 (#### 置換対応) ▼▼▼ ---
-            final_filepath = None
-            path_to_check = None
-
-            # 戻り値がリストか文字列かチェック
-            if isinstance(actual_filepath_raw, (list, tuple)) and actual_filepath_raw:
-                path_to_check = actual_filepath_raw[0] # リストなら最初の要素
-            elif isinstance(actual_filepath_raw, str) and actual_filepath_raw:
-                path_to_check = actual_filepath_raw # 文字列ならそのまま
-            else:
-                # 戻り値が無効な場合は期待パスでチェック (フォールバック)
-                print(f"[{panel}] 警告: Playblastの戻り値が無効 ({actual_filepath_raw})。期待パス ({filepath}) で確認します。")
-                path_to_check = filepath
-
-            # path_to_check が有効な文字列か確認
-            if isinstance(path_to_check, str):
-                # "####" が含まれているかチェック
-                if "####" in path_to_check:
-                    try:
-                        # start_frame を使って #### を置換
-                        # framePadding=4 なので、4桁ゼロ埋め
-                        frame_str = str(start_frame).zfill(4)
-                        final_filepath = path_to_check.replace("####", frame_str)
-                        print(f"[{panel}] ファイルパスの #### を置換: {path_to_check} -> {final_filepath}")
-                    except Exception as fmt_e:
-                        print(f"[{panel}] !!! #### の置換中にエラー: {fmt_e}")
-                        final_filepath = None # 置換失敗
-                else:
-                    # #### が含まれていない場合はそのまま使用
-                    final_filepath = path_to_check
-            else:
-                 print(f"[{panel}] 警告: 有効なファイルパス文字列が得られませんでした。")
-                 final_filepath = None
 
-            # --- ファイルチェック ---
-            if final_filepath and os.path.exists(final_filepath):
-                file_size = os.path.getsize(final_filepath)
-                print(f"[{panel}] ファイル生成確認: 存在します。パス: {final_filepath}, サイズ: {file_size} bytes")
+# --- スナップショット撮影のコア機能 (generate_snapshot) ---
+    def generate_snapshot(self, panel, filepath, width, height, display_filter, display_mode, is_preview=False, current_selection=None):
+        """
+        指定された設定でビューポートのスナップショットを撮影する内部メソッド。
+        (playblastの戻り値の #### 置換対応)
+        current_selection を省略した場合、'選択オブジェクトのみ' モードではここで選択を取得する。
+        """
+        self._log("\n--- generate_snapshot 開始: パネル='%s', ファイル='%s' ---", panel, filepath)
+        try:
+            capture_settings = self._build_capture_settings(display_filter, display_mode, current_selection)
+            actual_filepath_raw, padded_frame = self._capture_panel(panel, filepath, width, height, capture_settings,
+                                                                    image_format=self.PREVIEW_IMAGE_FORMAT if is_preview else None)
+
+            # --- ファイルパス処理 (#### 置換) とファイルチェック ---
+            final_filepath, file_size = _resolve_output_file(actual_filepath_raw, filepath, padded_frame)
+            if file_size is not None:
+                self._log("[%s] ファイル生成確認: 存在します。パス: %s, サイズ: %s bytes", panel, final_filepath, file_size)
                 if is_preview:
-                    initial_temp_path = filepath
-                    if initial_temp_path != final_filepath and os.path.exists(initial_temp_path):
-                        try: os.remove(initial_temp_path); print(f"[{panel}] 初期期待パスのファイルを削除: {initial_temp_path}")
-                        except OSError as e: print(f"[{panel}] 初期期待パスファイルの削除に失敗: {e}")
                     self.temp_preview_file = final_filepath
-                    print(f"[{panel}] プレビュー用一時ファイルパスを更新: {self.temp_preview_file}")
+                    self._log("[%s] プレビュー用一時ファイルパスを更新: %s", panel, self.temp_preview_file)
             else:
-                if final_filepath:
-                    print(f"[{panel}] !!! 警告: Playblast後、最終的なファイルが見つかりません: {final_filepath}")
-                else:
-                    print(f"[{panel}] !!! 警告: 有効なファイルパスが決定できなかったため、ファイルを確認できませんでした。")
+                _logger.warning("[%s] !!! 警告: Playblast後、最終的なファイルが見つかりません: %s", panel, final_filepath)
                 if is_preview:
                     self.temp_preview_file = None
-                    print(f"[{panel}] プレビュー用一時ファイルパスを None に設定しました。")
-            # --- ▲▲▲ ファイルパス処理完了 ▲▲▲ ---
+                    self._log("[%s] プレビュー用一時ファイルパスを None に設定しました。", panel)
 
         except Exception as e:
-            print(f"[{panel}] !!! generate_snapshot 処理中にエラーが発生: {e}")
+            _logger.error("[%s] !!! generate_snapshot 処理中にエラーが発生: %s", panel, e)
             raise e
 
         finally:
-            # --- 4. 表示設定の復元 --- (変更なし)
-            print(f"[{panel}] 表示設定を復元中...")
+            _flush_log()
+            if self._verbose:
+                # 終了行は溜めたログを書き出した後に直接書き込む (print やロガーを通さない)
+                sys.stdout.write(f"--- generate_snapshot 終了: パネル='{panel}' ---\n")
+
+    def _build_capture_settings(self, display_filter, display_mode, current_selection=None):
+        """
+        撮影するパネルに共通の設定 (modelEditor に渡すフラグ、装飾の表示、Isolate Select の有無と選択) を求める。
+        一括撮影では1回だけ計算して全パネルで使い回す。
+        '選択オブジェクトのみ' モードで current_selection が None の場合は、ここで選択を1回だけ取得する。
+        """
+        self._log("表示設定: Filter='%s', Mode='%s'", display_filter, display_mode)
+        isolate_selected = display_mode == 'selected_only'
+        if isolate_selected and current_selection is None:
+            current_selection = cmds.ls(selection=True, long=True)
+        return {
+            # 無効化と有効化をまとめた設定はフィルターごとに事前計算済み (1回の edit で適用)
+            'edit_flags': self._FILTER_EDIT_FLAGS.get(display_filter, self._FILTER_EDIT_FLAGS['all']),
+            # 'viewport_all' 以外 (シーンオブジェクトのみ / 選択オブジェクトのみ) はグリッド等を表示しない
+            'show_ornaments': display_mode not in ('scene_objects', 'selected_only'),
+            'isolate_selected': isolate_selected,
+            'selection': current_selection or [],
+        }
+
+    def _capture_panel(self, panel, filepath, width, height, capture_settings, image_format=None):
+        """
+        パネルの表示設定を保存・変更して playblast し、元に戻す。
+        capture_settings は _build_capture_settings の戻り値。
+        (playblast の生の戻り値, パディング済みのフレーム番号文字列) を返す。
+        """
+        if not cmds.modelPanel(panel, exists=True):
+             _logger.error("エラー: 指定されたパネル '%s' が存在しません。", panel)
+             raise ValueError(f"指定されたパネル '{panel}' が存在しません。")
+
+        # --- 1, 2. 元の表示設定を保存して変更 (再描画を停止し、playblast 時の1回に集約) ---
+        main_pane = self._suspend_viewport_refresh()
+        saved = None
+        resumed = False
+        try:
+            saved = self._save_state(panel)
+            self._apply_state(panel, saved, capture_settings)
+
+            # --- 3. スナップショット撮影 ---
+            # 撮影前に再描画を再開 (停止したままだと playblast が正しく描画されない場合がある)
+            self._resume_viewport_refresh(main_pane)
+            resumed = True
+            return self._do_playblast(panel, filepath, width, height, capture_settings['show_ornaments'], image_format=image_format)
+
+        finally:
+            # --- 4. 表示設定の復元 --- (再描画の停止/再開は _restore_state 内で行う。変更していなければ何もしない)
             try:
-                if isolate_activated and isolate_available:
+                if saved is not None:
+                    self._restore_state(panel, saved)
+            finally:
+                if not resumed:
+                    # 撮影前に失敗した場合は、復元で例外が出ても停止したままの再描画を必ず再開する
+                    self._resume_viewport_refresh(main_pane, force=True)
+
+    def _save_state(self, panel):
+        """
+        パネルの元の表示設定を保存する。戻り値の dict を _restore_state に渡して元に戻す。
+        フラグごとに問い合わせず、stateString で全設定を復元用の MEL として1回で取得する。
+        """
+        saved = {'original_state': None, 'original_flags': {}, 'isolation_state': False, 'isolate_activated': False}
+        isolate_available = self._isolate_cache.get(panel)
+        if isolate_available is None:
+            isolate_available = self._isolate_cache[panel] = self._probe_isolate(panel)
+        saved['isolate_available'] = isolate_available
+        self._log("[%s] 元の設定を保存中...", panel)
+        try:
+            saved['original_state'] = cmds.modelEditor(panel, query=True, stateString=True)
+            # 復元時に比較するフラグは保存時に1回だけ取り出しておく
+            saved['original_flags'] = _parse_state_flags(saved['original_state'])
+            self._log("[%s] modelEditor の設定を保存しました。", panel)
+        except RuntimeError as state_e: _logger.warning("[%s] modelEditor 設定の取得に失敗: %s", panel, state_e)
+        if isolate_available:
+            try: saved['isolation_state'] = _ISO_STATE_CACHE[panel] = cmds.isolateSelect(panel, query=True, state=True); self._log("[%s] 元の Isolate Select 状態: %s", panel, saved['isolation_state'])
+            except Exception as iso_e: _logger.warning("[%s] 元の Isolate Select 状態の取得に失敗: %s", panel, iso_e); saved['isolation_state'] = False
+        else: self._log("[%s] Isolate Select はこのパネルでは利用できません。", panel)
+        return saved
+
+    def _apply_state(self, panel, saved, capture_settings):
+        """パネルを撮影用の表示設定に変更する。Isolate Select を有効にした場合は saved に記録する。"""
+        self._log("[%s] 表示設定を変更中...", panel)
+        if capture_settings['isolate_selected']:
+            isolate_available = saved['isolate_available']
+            current_selection = capture_settings['selection']
+            if current_selection and isolate_available:
+                try: cmds.isolateSelect(panel, state=True); saved['isolate_activated'] = True; _ISO_STATE_CACHE[panel] = True; self._dirty_panels.add(panel)
+                except Exception as iso_e: _logger.warning("[%s] Isolate Select の有効化に失敗: %s", panel, iso_e)
+            elif not current_selection: self._log("[%s] '選択オブジェクトのみ' モードですが、選択がありません。(generate_snapshot)", panel)
+            elif not isolate_available: self._log("[%s] '選択オブジェクトのみ' モードですが、Isolate Select が利用できません。", panel)
+        # allObjects は stateString に含まれず、allObjects=False で非表示になる種類も比較できないため、edit は常に行う
+        self._dirty_panels.add(panel) # edit の途中で失敗しても復元されるよう先に記録
+        cmds.modelEditor(panel, edit=True, **capture_settings['edit_flags'])
+
+    def _do_playblast(self, panel, filepath, width, height, show_ornaments, image_format=None):
+        """
+        パネルを現在フレームで1枚 playblast する。(playblast の生の戻り値, パディング済みのフレーム番号文字列) を返す。
+        image_format を指定すると、その画像形式 (playblast の compression) で書き出す。
+        メインスレッドから呼び出すこと。
+        """
+        self._log("[%s] Playblast 実行準備: 解像度=%sx%s, 装飾=%s", panel, width, height, show_ornaments)
+        current_time = int(cmds.currentTime(query=True)) # フレーム番号は整数で取得
+        start_frame = current_time # 静止画なので開始フレーム番号を保持
+        self._log("[%s] Playblast (初期期待パス): %s", panel, filepath)
+        actual_filepath_raw = None # playblastからの生の戻り値
+        format_options = {'compression': image_format} if image_format else {}
+        try:
+            actual_filepath_raw = cmds.playblast(
+                activeEditor=False, editorPanelName=panel,
+                startTime=start_frame, endTime=start_frame, # 開始・終了フレームを指定
+                format='image',
+                filename=os.fspath(filepath),
+                sequenceTime=0, clearCache=True, viewer=False,
+                showOrnaments=show_ornaments, offScreen=True, forceOverwrite=True,
+                framePadding=_FRAME_PADDING, # 戻り値の #### と桁数を合わせる (重要)
+                percent=100, quality=100, widthHeight=[width, height],
+                **format_options
+            )
+            self._log("[%s] Playblast 正常終了。", panel)
+            self._log("[%s] Playblast 戻り値 (Raw): %s", panel, actual_filepath_raw)
+        except Exception as pb_e:
+             _logger.error("[%s] !!! Playblast 実行中にエラーが発生しました: %s", panel, pb_e)
+             raise pb_e
+        if not actual_filepath_raw:
+            _logger.warning("[%s] 警告: Playblastの戻り値が無効 (%s)。期待パス (%s) で確認します。", panel, actual_filepath_raw, filepath)
+        return actual_filepath_raw, f"{start_frame:0{_FRAME_PADDING}d}"
+
+    def _restore_state(self, panel, saved):
+        """
+        _save_state で保存した表示設定に戻す。
+        Isolate Select や modelEditor を edit する必要がある場合だけ再描画を停止し、最後に1回だけ強制再描画する。
+        一括撮影でもパネルごとに撮影と同じ処理の中で戻し、撮影用の表示のままアイドルにならないようにする。
+        _apply_state で表示設定を変更していないパネルは何もしない。
+        """
+        # 撮影用に何も変更していなければ (_apply_state で記録されていなければ) 何もしない
+        if panel not in self._dirty_panels:
+            self._log(_MSG_RESTORE_SKIPPED, panel)
+            return
+        self._dirty_panels.discard(panel)
+        isolation_state = saved['isolation_state']
+        self._log(_MSG_RESTORE_START, panel)
+        # 前提条件は事前に確認し、Maya のコマンドが失敗したとき (RuntimeError) だけ外側の try で受ける
+        # (それ以外の例外は generate_snapshot / 撮影キューの処理まで伝わる)
+        try:
+            _me, _iso = cmds.modelEditor, cmds.isolateSelect
+            if cmds.getPanel(typeOf=panel) != "modelPanel":
+                _logger.warning(_MSG_RESTORE_NOT_MODEL_PANEL, panel)
+                return
+
+            # --- 戻す内容を先に決める (問い合わせだけなら再描画は起きない) ---
+            restore_isolate = False
+            if saved['isolate_activated'] and saved['isolate_available']:
+                current_iso_state_before_restore = _ISO_STATE_CACHE.get(panel)
+                if current_iso_state_before_restore is None:
+                    current_iso_state_before_restore = _iso(panel, query=True, state=True)
+                restore_isolate = current_iso_state_before_restore != isolation_state
+
+            original_state = saved['original_state']
+            original_flags = saved['original_flags']
+            # stateString から読み取れない場合は、保存した MEL をそのまま実行して全体を戻す
+            restore_full = bool(original_state) and not original_flags
+            changed_flags = {}
+            if not original_state:
+                _logger.warning(_MSG_STATE_NOT_SAVED, panel)
+            elif original_flags:
+                # 現在の設定と比べて、実際に変わっているフラグだけを戻す
+                current_flags = _parse_state_flags(_me(panel, query=True, stateString=True))
+                changed_flags = {k: v for k, v in original_flags.items() if current_flags.get(k) != v}
+                if not changed_flags:
+                    self._log(_MSG_FLAGS_UNCHANGED, panel)
+
+            if not (restore_isolate or restore_full or changed_flags):
+                return
+
+            # --- 戻す (再描画を停止し、最後に1回だけ再描画) ---
+            main_pane = self._suspend_viewport_refresh()
+            try:
+                if restore_isolate:
+                    _iso(panel, state=isolation_state)
+                    _ISO_STATE_CACHE[panel] = isolation_state
+                    self._log(_MSG_ISO_RESTORED, panel, isolation_state)
+                if restore_full:
+                    self._restore_full_state(panel, original_state)
+                    self._log(_MSG_STATE_RESTORED, panel)
+                elif changed_flags:
+                    self._apply_restores([(panel, changed_flags, original_state)])
+            finally:
+                self._resume_viewport_refresh(main_pane, force=True)
+
+        except RuntimeError as e: _logger.error(_MSG_RESTORE_ERROR, panel, e)
+
+
+    def _apply_restores(self, restores):
+        """
+        (パネル, 差分のフラグ, 元の stateString) のリストを受け取り、modelEditor の設定をまとめて戻す。
+        Undo の1チャンクにまとめる。差分で戻せなかったパネルは stateString で全体を戻す。
+        """
+        _me = cmds.modelEditor # パネル数だけ繰り返すのでローカルに束縛
+        cmds.undoInfo(openChunk=True, chunkName="snapshotRestore")
+        try:
+            for panel, changed_flags, original_state in restores:
+                if changed_flags:
                     try:
-                        current_iso_state_before_restore = cmds.isolateSelect(panel, query=True, state=True)
-                        if current_iso_state_before_restore != isolation_state:
-                             cmds.isolateSelect(panel, state=isolation_state)
-                             print(f"[{panel}] Isolate Select の状態を元 ({isolation_state}) に戻しました。")
-                    except Exception as iso_e: print(f"[{panel}] Isolate Select の復元中にエラー: {iso_e}")
-
-                if original_settings:
-                    valid_settings = {k: v for k, v in original_settings.items() if v is not None}
-                    if valid_settings:
-                        cmds.modelEditor(panel, edit=True, **valid_settings)
-                        print(f"[{panel}] modelEditor 設定 ({len(valid_settings)}項目) を復元しました。")
-                else: print(f"[{panel}] 警告: 元の modelEditor 設定が保存されていませんでした。")
-
-            except Exception as e: print(f"[{panel}] !!! 表示設定の復元中にエラーが発生しました: {e}")
-
-            print(f"--- generate_snapshot 終了: パネル='{panel}' ---")
+                        # 通常のフラグは1回の edit で、プラグインの表示フィルターは1つずつ戻す
+                        edit_flags = {k: v for k, v in changed_flags.items() if isinstance(k, str)}
+                        if edit_flags:
+                            _me(panel, edit=True, **edit_flags)
+                        for key, value in changed_flags.items():
+                            if not isinstance(key, str):
+                                _me(panel, edit=True, pluginObjects=(key[1], value))
+                    except (RuntimeError, TypeError) as diff_e:
+                        _logger.warning(_MSG_FLAGS_RESTORE_FAILED, panel, diff_e)
+                        try:
+                            self._restore_full_state(panel, original_state)
+                        except RuntimeError as full_e:
+                            # 撮影中にパネルが削除された場合など。残りのパネルの復元は続ける
+                            _logger.error(_MSG_RESTORE_ERROR, panel, full_e)
+                            continue
+                    self._log(_MSG_FLAGS_RESTORED, panel, len(changed_flags))
+        finally:
+            cmds.undoInfo(closeChunk=True)
+
+    def _restore_full_state(self, panel, state_string):
+        """stateString で保存した MEL を実行して modelEditor の設定全体を戻す。"""
+        # stateString は $editorName を対象にした MEL なので、変数を定義してから実行する
+        mel.eval('{ string $editorName = "%s";\n%s\n}' % (panel, state_string))
+
+
 if __name__ == "__main__":
     try:
-        snapshot_tool_instance = ViewportSnapshotTool()
+        # 再実行時はウィンドウが開いたままなら前回のインスタンスを再利用し、UIを作り直さない
+        snapshot_tool_instance = sys.modules.get("_snaptool_inst")
+        if snapshot_tool_instance is None or not snapshot_tool_instance.show():
+            snapshot_tool_instance = sys.modules["_snaptool_inst"] = ViewportSnapshotTool()
     except Exception as e:
+        import traceback # エラー詳細表示用 (失敗時のみ読み込む)
         print(f"ツールの起動に失敗しました: {e}")
-        print(traceback.format_exc())
+        traceback.print_exc(file=sys.stdout)